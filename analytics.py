@@ -2,6 +2,22 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
+# 분석용 컬럼 dtype (연/월/일은 작은 정수, 평형/평당가는 float32로 줄여 스캔량 절감)
+# 단지 식별자는 category로 변환하여 groupby가 문자열 대신 정수 코드로 동작하도록 함
+# exclu_use_ar는 평형 밴드 경계값과 정확히 비교해야 하므로 float64 유지
+COMPACT_DTYPES = {
+    'apt_seq': 'category',
+    'apt_nm': 'category',
+    'deal_year': 'int16',
+    'deal_month': 'int8',
+    'deal_day': 'int8',
+    'build_year': 'int16',
+    'age': 'int16',
+    'pyeong': 'float32',
+    'pyeong_price_won': 'float32',
+    'pyeong_price_man': 'float32'
+}
+
 def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
@@ -9,64 +25,86 @@ def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
     # 1. pyeong: 전용면적 / 3.30578
     df['pyeong'] = df['exclu_use_ar'] / 3.30578
     
-    # 2. price calculations
-    df['pyeong_price_won'] = (df['deal_amount'] * 10000) / df['pyeong']
-    df['pyeong_price_man'] = df['deal_amount'] / df['pyeong']
+    # 2. price calculations (전용면적이 0이면 평당가는 inf 대신 결측으로 저장, DB 마이그레이션의 NULLIF와 동일)
+    pyeong = df['pyeong'].mask(df['pyeong'] == 0)
+    df['pyeong_price_won'] = (df['deal_amount'] * 10000) / pyeong
+    df['pyeong_price_man'] = df['deal_amount'] / pyeong
+    
+    # 3. age
+    return add_age_columns(df)
+
+def add_age_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # age는 현재 연도에 따라 달라지므로 DB에 저장하지 않고 조회 시점에 계산
+    if df.empty:
+        return df
     
-    # 3. age: current_year - build_year
+    # age: current_year - build_year
     current_year = datetime.now().year
     df['age'] = current_year - df['build_year']
     df['age_is_estimated'] = True # As per requirement "추측입니다"
     
     return df
 
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    
+    return df.astype({c: t for c, t in COMPACT_DTYPES.items() if c in df.columns})
+
 def filter_size_band(df: pd.DataFrame, min_m2: float, max_m2: float) -> pd.DataFrame:
     return df[(df['exclu_use_ar'] >= min_m2) & (df['exclu_use_ar'] <= max_m2)]
 
 def compute_leading_complex(df: pd.DataFrame, lookback_years: int, n_total: int, n_85: int, min_m2: float, max_m2: float) -> dict:
+    params = {"lookback_years": lookback_years, "n_total": n_total, "n_85": n_85, "min_m2": min_m2, "max_m2": max_m2}
     if df.empty:
-        return {"top1": None, "top5": None, "params": locals(), "notes": "데이터가 없습니다."}
+        return {"top1": None, "top5": None, "params": params, "notes": "데이터가 없습니다."}
     
     # 1. 선정 전용 데이터셋 (기간 필터)
     current_year = datetime.now().year
     df_recent = df[df['deal_year'] >= (current_year - lookback_years)]
+    in_band = df_recent['exclu_use_ar'].between(min_m2, max_m2)
     
-    # 2. 전체 거래수 집합 (모든 평형 합산)
-    total_stats = df_recent.groupby(['apt_seq', 'apt_nm']).agg(
-        build_year=('build_year', 'max'),
-        cnt_total=('deal_amount', 'count')
-    ).reset_index()
+    # 2. 전체/밴드 거래수 집합 (한 번의 groupby로 모든 평형 합산과 밴드 건수를 함께 계산)
+    count_stats = df_recent.assign(in_band=in_band).groupby(['apt_seq', 'apt_nm'], observed=True).agg(
+        cnt_total=('deal_amount', 'count'),
+        cnt_band=('in_band', 'sum')
+    )
     
-    # 3. 밴드 내 통계 집합 (설정 평형 한정: 가격 및 건수)
-    df_band = filter_size_band(df_recent, min_m2, max_m2)
-    band_stats = df_band.groupby(['apt_seq', 'apt_nm']).agg(
-        cnt_band=('deal_amount', 'count'),
+    # 3. 밴드 내 가격 통계 (밴드 행만 남긴 프레임에서 계산)
+    band_stats = df_recent[in_band].groupby(['apt_seq', 'apt_nm'], observed=True).agg(
         median_pyeong_price_man=('pyeong_price_man', 'median'),
         median_pyeong=('pyeong', 'median')
-    ).reset_index()
+    )
     
     # 밴드 내 중위 매매가 계산 (평형 * 중위평당가)
     band_stats['median_deal_amount_band'] = band_stats['median_pyeong'] * band_stats['median_pyeong_price_man']
     
-    # 4. 두 집합 결합 (밴드 내 거래가 있는 단지 기준)
-    grouped = pd.merge(total_stats, band_stats, on=['apt_seq', 'apt_nm'], how='inner')
+    # 4. 두 집합 결합 (밴드 내 거래가 있는 단지 기준, 같은 그룹 인덱스로 join)
+    grouped = count_stats.join(band_stats, how='inner').reset_index()
     
     # 5. 최종 필터링: 전체 거래수 >= n_total AND 밴드 거래수 >= n_85
     filtered = grouped[(grouped['cnt_total'] >= n_total) & (grouped['cnt_band'] >= n_85)]
     
     if filtered.empty:
-        return {"top1": None, "top5": None, "params": locals(), "notes": "조건을 만족하는 단지가 없습니다."}
+        return {"top1": None, "top5": None, "params": params, "notes": "조건을 만족하는 단지가 없습니다."}
     
     # Sort by median price
     sorted_df = filtered.sort_values(by='median_pyeong_price_man', ascending=False)
     
-    top1 = sorted_df.iloc[0].to_dict()
     top5 = sorted_df.head(5)
     
+    # 건축년도는 표시되는 상위 단지에 대해서만 조회
+    top_rows = df_recent[df_recent['apt_seq'].isin(top5['apt_seq'])]
+    build_year = top_rows.groupby(['apt_seq', 'apt_nm'], observed=True)['build_year'].max()
+    top5 = top5.join(build_year, on=['apt_seq', 'apt_nm'])
+    
+    # 화면에 쓰이는 필드만 위치 기반으로 추출
+    top1 = {c: top5[c].iat[0] for c in ('apt_nm', 'median_pyeong_price_man', 'cnt_total', 'build_year', 'cnt_band', 'median_deal_amount_band')}
+    
     return {
         "top1": top1,
         "top5": top5,
-        "params": {"lookback_years": lookback_years, "n_total": n_total, "n_85": n_85, "min_m2": min_m2, "max_m2": max_m2},
+        "params": params,
         "notes": "거래빈도는 단지 규모 대리변수이므로 결과에 확실하지 않음 문구 포함"
     }
 
@@ -74,20 +112,12 @@ def compute_age_group_levels(df_band: pd.DataFrame, min_samples: int = 10) -> pd
     if df_band.empty:
         return pd.DataFrame()
     
-    # Define age groups
-    def get_age_group(age):
-        if age <= 5: return "신축(5년이내)"
-        elif age <= 10: return "준신축(5~10년)"
-        else: return "구축(10년이상)"
-    
-    df_band = df_band.copy()
-    df_band['age_group'] = df_band['age'].apply(get_age_group)
-    
-    # 정해진 순서대로 정렬하기 위해 Categorical 데이터 처리
+    # 연식 구간 정의 (5년 이내 / 5~10년 / 10년 초과), 순서가 있는 Categorical로 생성
     order = ["신축(5년이내)", "준신축(5~10년)", "구축(10년이상)"]
-    df_band['age_group'] = pd.Categorical(df_band['age_group'], categories=order, ordered=True)
+    age_group = pd.cut(df_band['age'], bins=[-np.inf, 5, 10, np.inf], labels=order, right=True).rename('age_group')
     
-    summary = df_band.groupby('age_group', observed=True).agg(
+    # 프레임 복사 없이 집계에 필요한 두 컬럼만 연식 구간으로 그룹화
+    summary = df_band[['pyeong_price_man', 'deal_amount']].groupby(age_group, observed=True).agg(
         median_pyeong_price_man=('pyeong_price_man', 'median'),
         mean_pyeong_price_man=('pyeong_price_man', 'mean'),
         median_deal_amount=('deal_amount', 'median'),
@@ -98,30 +128,51 @@ def compute_age_group_levels(df_band: pd.DataFrame, min_samples: int = 10) -> pd
     
     return summary
 
+def group_median_count(codes: np.ndarray, values: np.ndarray, n_groups: int):
+    # (그룹 코드, 값) 기준으로 한 번만 정렬한 뒤 그룹별 구간의 가운데 값으로 중앙값 계산
+    # NaN은 각 그룹 구간의 끝으로 정렬되므로 유효 건수만으로 가운데 위치를 잡아 제외
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    
+    volume = np.bincount(codes, minlength=n_groups)
+    valid = np.bincount(codes[~np.isnan(values)], minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(volume)[:-1]))
+    
+    median = np.full(n_groups, np.nan)
+    has = valid > 0
+    lo = starts[has] + (valid[has] - 1) // 2
+    hi = starts[has] + valid[has] // 2
+    median[has] = (sorted_values[lo] + sorted_values[hi]) / 2
+    
+    return median, volume
+
 def compute_trend(df_band: pd.DataFrame) -> dict:
     if df_band.empty:
         return {"monthly": None, "short_momentum_pct": 0, "long_slope": 0, "long_trend_label": "데이터 부족", "notes": ""}
     
-    # Monthly aggregation
-    monthly = df_band.groupby('deal_ymd').agg(
-        median_price=('pyeong_price_man', 'median'),
-        volume=('deal_amount', 'count')
-    ).reset_index().sort_values('deal_ymd')
+    # Monthly aggregation (월 코드는 정렬된 순서로 부여되므로 결과도 deal_ymd 오름차순)
+    codes, months = pd.factorize(df_band['deal_ymd'], sort=True)
+    values = df_band['pyeong_price_man'].to_numpy(dtype=np.float64)
+    keep = codes >= 0
+    median_price, volume = group_median_count(codes[keep], values[keep], len(months))
+    monthly = pd.DataFrame({'deal_ymd': np.asarray(months), 'median_price': median_price, 'volume': volume})
     
     if len(monthly) < 2:
         return {"monthly": monthly, "short_momentum_pct": 0, "long_slope": 0, "long_trend_label": "데이터 부족", "notes": "분석을 위한 데이터가 부족합니다."}
     
     # Short momentum: Last 2 available months
-    recent_2 = monthly.tail(2)
-    short_momentum_pct = ((recent_2.iloc[-1]['median_price'] / recent_2.iloc[0]['median_price']) - 1) * 100 if len(recent_2) == 2 else 0
+    prices = monthly['median_price'].to_numpy()
+    short_momentum_pct = (prices[-1] / prices[-2] - 1) * 100 if prices.size >= 2 else 0
     
     # Long trend: Last 36 months linear regression
     last_36 = monthly.tail(36)
-    x = np.arange(len(last_36))
-    y = last_36['median_price'].values
+    x = np.arange(len(last_36), dtype=np.float64)
+    y = last_36['median_price'].to_numpy(dtype=np.float64)
     
     if len(last_36) >= 12: # Minimum 12 months for "long" trend
-        slope, _ = np.polyfit(x, y, 1)
+        # 1차 최소제곱 기울기 (closed form): sum((x-x̄)(y-ȳ)) / sum((x-x̄)^2)
+        xc = x - x.mean()
+        slope = np.dot(xc, y - y.mean()) / np.dot(xc, xc)
         long_trend_label = "상승" if slope > 0 else "하락"
     else:
         slope = 0
@@ -2,11 +2,12 @@ import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
+from matplotlib.figure import Figure
+import io
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import os
 import sys
-import time
 import platform
 try:
     import koreanize_matplotlib
@@ -80,27 +81,25 @@ def format_for_display(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
     
-    display_df = df.copy()
+    # 1. 불필요 컬럼을 제외한 표시 대상 컬럼만 복사
+    cols_present = [c for c in df.columns if c not in DROP_COLUMNS]
+    display_df = df[cols_present].copy()
     
     # 평당가(원)를 만원 단위로 조정하여 표시 (사용자 요청)
     if 'pyeong_price_won' in display_df.columns:
         display_df['pyeong_price_won'] = display_df['pyeong_price_won'] / 10000
     
-    # 1. 불필요 컬럼 삭제
-    cols_to_drop = [c for c in DROP_COLUMNS if c in display_df.columns]
-    display_df = display_df.drop(columns=cols_to_drop)
-    
     # 2. 형 변환
-    # 정수형 컬럼 처리 (소수점 제거 및 정수 캐스팅)
-    for col in INT_COLUMNS + ['deal_amount']:
-        if col in display_df.columns:
-            display_df[col] = pd.to_numeric(display_df[col], errors='coerce').fillna(0).astype(int)
+    # 정수형 컬럼 처리 (소수점 제거 후 한 번의 astype으로 일괄 정수 캐스팅)
+    int_map = {c: 'int64' for c in INT_COLUMNS + ['deal_amount'] if c in display_df.columns}
+    display_df = display_df.assign(
+        **{c: pd.to_numeric(display_df[c], errors='coerce').fillna(0) for c in int_map}
+    ).astype(int_map)
 
     # 실수형 컬럼 처리 (면적, 평형 등 소수점 2자리)
-    float_cols = ['exclu_use_ar', 'pyeong', 'median_pyeong']
-    for col in float_cols:
-        if col in display_df.columns:
-            display_df[col] = pd.to_numeric(display_df[col], errors='coerce').round(2)
+    float_cols = [c for c in ['exclu_use_ar', 'pyeong', 'median_pyeong'] if c in display_df.columns]
+    if float_cols:
+        display_df[float_cols] = display_df[float_cols].apply(pd.to_numeric, errors='coerce').round(2)
             
     # 3. 컬럼명 한글화
     display_df = display_df.rename(columns=COLUMN_MAPPING)
@@ -128,6 +127,35 @@ def style_dataframe(df: pd.DataFrame):
     applied_formats = {k: v for k, v in format_dict.items() if k in df.columns}
     return df.style.format(applied_formats, na_rep="-")
 
+@st.cache_data(max_entries=32)
+def render_trend_png(monthly: pd.DataFrame, title: str) -> bytes:
+    """월별 평당가/거래량 차트를 PNG로 렌더링합니다. 같은 월별 데이터와 제목이면 렌더링된 이미지를 재사용합니다."""
+    # pyplot 전역 상태를 쓰지 않는 Figure를 세션마다 따로 만들고, 캐시에는 스레드 간 공유해도 안전한 PNG 바이트만 저장
+    fig = Figure(figsize=(12, 5))
+    ax1 = fig.subplots()
+    ax2 = ax1.twinx()
+    
+    dates = pd.to_datetime(monthly['deal_ymd'].astype(str), format="%Y%m")
+    
+    ax1.plot(dates, monthly['median_price'], color='#1f77b4', marker='o', linewidth=2, label='평당가(중앙값)')
+    ax2.bar(dates, monthly['volume'], color='#d62728', alpha=0.3, width=20, label='거래량')
+    
+    ax1.set_xlabel("거래 시점", fontsize=10)
+    ax1.set_ylabel("평당가 (만원)", color='#1f77b4', fontsize=10)
+    ax2.set_ylabel("거래량 (건)", color='#d62728', fontsize=10)
+    ax1.grid(True, axis='y', linestyle='--', alpha=0.6)
+    
+    ax1.set_title(title, fontsize=14, pad=20)
+    
+    # 범례 통합 표시
+    lines, labels = ax1.get_legend_handles_labels()
+    bars, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines + bars, labels + labels2, loc='upper left')
+    
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
+    return buf.getvalue()
+
 # Page Config
 st.set_page_config(page_title="아파트 매매 실거래가 분석 앱", layout="wide")
 
@@ -177,13 +205,23 @@ def load_region_data_v2():
                 df['lawd_cd'] = df['code'].str[:5]
                 
                 # 시도/시군구 분리 로직
-                df['sido'] = df['region'].apply(lambda x: x.split(' ', 1)[0])
-                df['sigungu'] = df['region'].apply(lambda x: x.split(' ', 1)[1] if ' ' in x else "")
+                parts = df['region'].str.split(' ', n=1, expand=True).reindex(columns=[0, 1])
+                df['sido'] = parts[0]
+                df['sigungu'] = parts[1].fillna("")
                 return df
-        except:
+        except (ValueError, KeyError):
+            # 인코딩이 맞지 않거나(UnicodeDecodeError) 파싱에 실패하면 다음 인코딩으로 시도
             continue
     return None
 
+@st.cache_data
+def get_enriched(lawd_cd, start_year, version):
+    """조회 기간 내 거래 데이터에 연식 컬럼을 붙여 캐시합니다. version(최근 거래년월)이 바뀌면 다시 계산합니다."""
+    # 기간 필터는 SQL에서 적용하고, 평형/평당가는 적재 시 DB에 저장되므로 조회 시에는 연식만 계산
+    df = load_trades(lawd_cd, min_deal_year=start_year)
+    df = analytics.add_age_columns(df)
+    return analytics.compact_dtypes(df)
+
 # Sidebar
 st.sidebar.title("🔍 검색 설정")
 
@@ -263,7 +301,12 @@ DISCLAIMER = """
 - 거래 빈도는 단지의 규모와 유동성을 가늠하는 지표이며, 절대적인 우위를 보장하지 않습니다.
 """
 
-client = RTMSClient()
+@st.cache_resource
+def get_client():
+    """API 클라이언트를 한 번만 생성하여 모든 rerun/세션이 같은 HTTP 세션(연결 풀)을 재사용합니다."""
+    return RTMSClient()
+
+client = get_client()
 
 # Execution Logic: Data Loading
 if btn_update:
@@ -280,55 +323,62 @@ if btn_update:
             
             st.info(f"🔄 **전체 재수집**: {selected_name}의 최근 {period_years}년치({start_date.strftime('%Y-%m')} ~) 데이터를 새로 가져옵니다.")
             
-            date_range = client.get_date_range(start_date.strftime("%Y%m"), end_date.strftime("%Y%m"))
+            start_ymd, end_ymd = start_date.strftime("%Y%m"), end_date.strftime("%Y%m")
+            date_range = client.get_date_range(start_ymd, end_ymd)
             
             progress_bar = st.progress(0)
             status_text = st.empty()
             total_saved = 0
             total_months = len(date_range)
+            batches = []
             
             try:
-                for i, ymd in enumerate(date_range):
-                    status_text.text(f"📥 수집 처리 중: {ymd} ({i+1}/{total_months})")
-                    items, res_code = client.fetch_monthly_data(selected_lawd_cd, ymd)
-                    df_step = client.process_items(items, selected_lawd_cd)
-                    
-                    saved_count = len(df_step)
-                    if saved_count > 0:
-                        save_trades(df_step)
-                        total_saved += saved_count
-                        st.write(f"✅ {ymd}: {saved_count}건 저장 완료")
-                    else:
-                        st.write(f"⚪ {ymd}: 수집된 데이터 없음")
+                # 네트워크 대기가 대부분이므로 여러 달을 동시에 요청하고, 화면 갱신은 완료 순서대로 처리
+                try:
+                    for i, (ymd, items, res_code) in enumerate(client.fetch_range(selected_lawd_cd, start_ymd, end_ymd)):
+                        status_text.text(f"📥 수집 처리 중: {ymd} ({i+1}/{total_months})")
+                        df_step = client.process_items(items, selected_lawd_cd)
                         
-                    progress_bar.progress((i + 1) / total_months)
-                    time.sleep(0.1)
+                        saved_count = len(df_step)
+                        if saved_count > 0:
+                            batches.append(df_step)
+                            total_saved += saved_count
+                            st.write(f"✅ {ymd}: {saved_count}건 수집 완료")
+                        else:
+                            st.write(f"⚪ {ymd}: 수집된 데이터 없음")
+                            
+                        progress_bar.progress((i + 1) / total_months)
+                finally:
+                    # 수집된 월 데이터를 한 번에 저장 (오류가 나도 그때까지 수집한 데이터는 저장)
+                    if batches:
+                        save_trades(pd.concat(batches, ignore_index=True))
                 
                 if total_saved > 0:
                     st.success(f"🎊 완료! 총 {total_saved}건의 데이터를 성공적으로 갱신했습니다.")
                 else:
                     st.warning("⚠️ 모든 기간을 조회했으나 새로 수집된 데이터가 없습니다.")
+            except RateLimitError:
+                st.error("API 호출 한도를 초과했습니다. 잠시 후 다시 시도해 주세요. (그때까지 수집한 데이터는 저장되었습니다)")
             except Exception as e:
                 st.error(f"데이터 수집 중 오류 발생: {e}")
 
+            # 재수집 후 기간이 달라져도 최근 거래년월은 같을 수 있으므로 분석 캐시를 비웁니다
+            get_enriched.clear()
+
 # Execution Logic: Analysis
 if btn_analyze or 'df_trades' in st.session_state:
     if not selected_lawd_cd:
         st.error("지역을 먼저 선택해 주세요.")
     else:
-        df = load_trades(selected_lawd_cd)
-        if df.empty:
+        # [필터링] 1. 선택된 조회 기간(period_years) 필터 - DB 조회 시 적용 (데이터 갱신 전까지 캐시 재사용)
+        current_year = datetime.now().year
+        start_year = current_year - period_years
+        df_period = get_enriched(selected_lawd_cd, start_year, version=get_last_deal_ymd(selected_lawd_cd))
+        if df_period.empty:
             st.warning("데이터가 없습니다. 먼저 '데이터 적재/갱신' 버튼을 눌러 데이터를 수집해 주세요.")
         else:
-            # 파생 컬럼(평당가 등) 추가
-            df = analytics.add_derived_columns(df)
-
-            # [필터링] 1. 선택된 조회 기간(period_years) 필터
-            current_year = datetime.now().year
-            start_year = current_year - period_years
-            df_period = df[df['deal_year'] >= start_year]
-            
             # [필터링] 2. 선택된 평형 밴드(size_range) 필터
+            # (리딩 단지 전체 거래수와 KPI에 기간 전체 데이터가 필요하므로 밴드는 메모리에서 거름)
             df_band = analytics.filter_size_band(df_period, size_range[0], size_range[1])
             
             st.session_state['df_trades'] = df_period # 세션에는 기간 필터 버전 저장
@@ -354,28 +404,7 @@ if btn_analyze or 'df_trades' in st.session_state:
                 # 소제목 크기 조정 (h5)
                 st.markdown("<h5>📈 시세 및 거래량 추세 (선택 평형 대상)</h5>", unsafe_allow_html=True)
                 
-                fig, ax1 = plt.subplots(figsize=(12, 5))
-                ax2 = ax1.twinx()
-                
-                monthly = trend_data['monthly']
-                monthly['date'] = monthly['deal_ymd'].apply(lambda x: datetime.strptime(str(x), "%Y%m"))
-                
-                ax1.plot(monthly['date'], monthly['median_price'], color='#1f77b4', marker='o', linewidth=2, label='평당가(중앙값)')
-                ax2.bar(monthly['date'], monthly['volume'], color='#d62728', alpha=0.3, width=20, label='거래량')
-                
-                ax1.set_xlabel("거래 시점", fontsize=10)
-                ax1.set_ylabel("평당가 (만원)", color='#1f77b4', fontsize=10)
-                ax2.set_ylabel("거래량 (건)", color='#d62728', fontsize=10)
-                ax1.grid(True, axis='y', linestyle='--', alpha=0.6)
-                
-                plt.title(f"월별 평당가 및 거래량 추이 ({selected_name})", fontsize=14, pad=20)
-                
-                # 범례 통합 표시
-                lines, labels = ax1.get_legend_handles_labels()
-                bars, labels2 = ax2.get_legend_handles_labels()
-                ax1.legend(lines + bars, labels + labels2, loc='upper left')
-                
-                st.pyplot(fig)
+                st.image(render_trend_png(trend_data['monthly'], f"월별 평당가 및 거래량 추이 ({selected_name})"))
                 
                 st.write(f"🔍 **단기 모멘텀:** {trend_data['short_momentum_pct']}% | **장기 추세:** {trend_data['long_trend_label']} (기울기: {trend_data['long_slope']})")
                 st.caption(f"※ {trend_data['notes']}")
@@ -1,85 +1,199 @@
 import sqlite3
 import pandas as pd
-from datetime import datetime
+import pyarrow as pa
+import time
 import os
+import threading
+import atexit
+import analytics
 
 # DB 파일 경로를 절대 경로로 설정하여 배포 환경 안정성 확보
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_NAME = os.path.join(BASE_DIR, "rtms_trades.sqlite")
 
+# 적재 시점에 미리 계산해 저장하는 파생 컬럼
+DERIVED_COLUMNS = ['pyeong', 'pyeong_price_won', 'pyeong_price_man']
+
+# trade_raw 컬럼별 Arrow 타입 (load_trades에서 조회 결과를 컬럼 단위로 바로 변환할 때 사용)
+TRADE_ARROW_TYPES = {
+    'lawd_cd': pa.string(),
+    'deal_ymd': pa.int64(),
+    'deal_year': pa.int64(),
+    'deal_month': pa.int64(),
+    'deal_day': pa.int64(),
+    'apt_seq': pa.string(),
+    'apt_nm': pa.string(),
+    'umd_nm': pa.string(),
+    'jibun': pa.string(),
+    'exclu_use_ar': pa.float64(),
+    'deal_amount': pa.int64(),
+    'floor': pa.int64(),
+    'build_year': pa.int64(),
+    'created_at': pa.int64(),
+    'pyeong': pa.float64(),
+    'pyeong_price_won': pa.float64(),
+    'pyeong_price_man': pa.float64()
+}
+
+# trade_raw 테이블 정의 (created_at 마이그레이션 시 같은 정의로 새 테이블을 만들기 위해 이름만 바꿔 사용)
+TRADE_RAW_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        lawd_cd TEXT,
+        deal_ymd INTEGER,
+        deal_year INTEGER,
+        deal_month INTEGER,
+        deal_day INTEGER,
+        apt_seq TEXT,
+        apt_nm TEXT,
+        umd_nm TEXT,
+        jibun TEXT,
+        exclu_use_ar REAL,
+        deal_amount INTEGER,
+        floor INTEGER,
+        build_year INTEGER,
+        created_at INTEGER,
+        pyeong REAL,
+        pyeong_price_won REAL,
+        pyeong_price_man REAL,
+        UNIQUE(apt_seq, deal_year, deal_month, deal_day, exclu_use_ar, floor, deal_amount)
+    )
+"""
+
+def _apply_pragmas(conn):
+    # WAL 저널 + synchronous=NORMAL: 트랜잭션마다 fsync를 최소화하고 읽기와 쓰기가 서로 막지 않도록 함
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000") # 약 64MB 페이지 캐시
+
+# 모듈 단위로 재사용하는 연결 (호출마다 열고 닫는 비용 제거)
+# Streamlit 세션(스레드)들이 함께 쓰므로 check_same_thread=False로 열고 사용 구간은 _lock으로 직렬화
+_conn = None
+_lock = threading.RLock()
+
 def get_connection():
-    return sqlite3.connect(DB_NAME)
+    global _conn
+    with _lock:
+        if _conn is None:
+            # isolation_level=None: 자동 커밋 모드, 여러 문장을 묶을 때는 명시적으로 BEGIN
+            _conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+            _apply_pragmas(_conn)
+            atexit.register(_conn.close)
+        return _conn
 
 def init_db():
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS trade_raw (
-            lawd_cd TEXT,
-            deal_ymd INTEGER,
-            deal_year INTEGER,
-            deal_month INTEGER,
-            deal_day INTEGER,
-            apt_seq TEXT,
-            apt_nm TEXT,
-            umd_nm TEXT,
-            jibun TEXT,
-            exclu_use_ar REAL,
-            deal_amount INTEGER,
-            floor INTEGER,
-            build_year INTEGER,
-            created_at TEXT,
-            UNIQUE(apt_seq, deal_year, deal_month, deal_day, exclu_use_ar, floor, deal_amount)
-        )
-    """)
-    conn.commit()
-    conn.close()
+    # 스키마 생성과 마이그레이션을 하나의 트랜잭션으로 처리
+    with _lock, conn:
+        conn.execute("BEGIN")
+        cursor = conn.cursor()
+        cursor.execute(TRADE_RAW_DDL.format(table="trade_raw"))
+    
+        # 기존 DB 마이그레이션: 파생 컬럼(평형/평당가)이 없으면 추가 후 채움
+        existing = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(trade_raw)")}
+        missing = [c for c in DERIVED_COLUMNS if c not in existing]
+        for col in missing:
+            cursor.execute(f"ALTER TABLE trade_raw ADD COLUMN {col} REAL")
+        if missing:
+            # analytics.add_derived_columns와 동일한 계산 (전용면적이 0이면 평당가는 NULL)
+            cursor.execute("""
+                UPDATE trade_raw SET
+                    pyeong = exclu_use_ar / 3.30578,
+                    pyeong_price_won = (deal_amount * 10000.0) / (NULLIF(exclu_use_ar, 0) / 3.30578),
+                    pyeong_price_man = deal_amount / (NULLIF(exclu_use_ar, 0) / 3.30578)
+            """)
+        
+        # 기존 DB 마이그레이션: created_at이 TEXT("YYYY-MM-DD HH:MM:SS", 로컬 시각)이면 INTEGER(epoch 초)로 교체
+        # TEXT 컬럼에 정수를 넣으면 문자열로 저장되므로 새 정의로 테이블을 다시 만들어 옮김
+        # (RENAME/DROP COLUMN은 SQLite 3.25/3.35 이상에서만 지원되므로 구버전에서도 동작하는 방식 사용)
+        if existing.get('created_at', '').upper() == 'TEXT':
+            cols = list(TRADE_ARROW_TYPES)
+            select_cols = ", ".join(
+                "CAST(strftime('%s', created_at, 'utc') AS INTEGER)" if c == 'created_at' else c for c in cols
+            )
+            cursor.execute(TRADE_RAW_DDL.format(table="trade_raw_new"))
+            cursor.execute(f"INSERT INTO trade_raw_new ({', '.join(cols)}) SELECT {select_cols} FROM trade_raw")
+            cursor.execute("DROP TABLE trade_raw")
+            cursor.execute("ALTER TABLE trade_raw_new RENAME TO trade_raw")
+        
+        # 지역별 조회(load_trades)와 최근 거래년월 조회(get_last_deal_ymd)용 인덱스
+        # (UNIQUE 제약의 자동 인덱스는 apt_seq로 시작하므로 lawd_cd 조건에 쓰이지 않음)
+        # 테이블을 다시 만든 경우에도 생기도록 마이그레이션 뒤에 생성
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trade_lawd_ymd ON trade_raw(lawd_cd, deal_ymd DESC)")
 
 def save_trades(df: pd.DataFrame):
     if df.empty:
         return
     
     conn = get_connection()
-    # Adding created_at
-    df['created_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Adding created_at (epoch 초, 배치 전체에 같은 정수 하나를 브로드캐스트)
+    df['created_at'] = int(time.time())
+    
+    # 파생 컬럼(평형, 평당가)은 적재 시 한 번만 계산하여 저장
+    df = analytics.add_derived_columns(df)
     
     # We use INSERT OR IGNORE as required
     columns = [
         'lawd_cd', 'deal_ymd', 'deal_year', 'deal_month', 'deal_day',
         'apt_seq', 'apt_nm', 'umd_nm', 'jibun', 'exclu_use_ar',
         'deal_amount', 'floor', 'build_year', 'created_at'
-    ]
+    ] + DERIVED_COLUMNS
     
     # Filter only required columns if exists
     df_to_save = df[[c for c in columns if c in df.columns]]
     
     placeholders = ", ".join(["?"] * len(df_to_save.columns))
     cols_str = ", ".join(df_to_save.columns)
-    sql = f"INSERT OR IGNORE INTO trade_raw ({cols_str}) VALUES ({placeholders})"
     
-    conn.executemany(sql, df_to_save.values.tolist())
-    conn.commit()
-    conn.close()
+    # 한 문장에 여러 행을 넣는 다중 VALUES INSERT
+    # 바인딩 변수 개수 제한(SQLite 3.32 이상 32766, 이전 999)을 넘지 않도록 행 단위로 나눔
+    max_vars = 30000 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    chunk = max(1, max_vars // len(df_to_save.columns))
+    # 컬럼별로 한 번에 Python 값 목록으로 변환한 뒤 행 튜플로 묶음 (셀 단위 변환 없음)
+    rows = list(zip(*(df_to_save[c].tolist() for c in df_to_save.columns)))
+    
+    # 전체 행을 하나의 트랜잭션으로 삽입 (with 블록 종료 시 COMMIT, 예외 시 ROLLBACK)
+    with _lock, conn:
+        conn.execute("BEGIN")
+        for i in range(0, len(rows), chunk):
+            batch = rows[i:i + chunk]
+            sql = f"INSERT OR IGNORE INTO trade_raw ({cols_str}) VALUES " + ", ".join([f"({placeholders})"] * len(batch))
+            conn.execute(sql, [v for row in batch for v in row])
 
 def get_last_deal_ymd(lawd_cd: str):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT MAX(deal_ymd) FROM trade_raw WHERE lawd_cd = ?", (lawd_cd,))
-    result = cursor.fetchone()[0]
-    conn.close()
+    with _lock:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(deal_ymd) FROM trade_raw WHERE lawd_cd = ?", (lawd_cd,))
+        result = cursor.fetchone()[0]
     return result
 
-def load_trades(lawd_cd: str) -> pd.DataFrame:
+def load_trades(lawd_cd: str, min_deal_year: int = None, min_m2: float = None, max_m2: float = None) -> pd.DataFrame:
+    """지역 거래 데이터를 조회합니다. 거래년도 하한/전용면적 범위가 주어지면 SQL 단계에서 거릅니다."""
     conn = get_connection()
     query = "SELECT * FROM trade_raw WHERE lawd_cd = ?"
-    df = pd.read_sql_query(query, conn, params=(lawd_cd,))
-    conn.close()
-    return df
+    params = [lawd_cd]
+    if min_deal_year is not None:
+        query += " AND deal_year >= ?"
+        params.append(min_deal_year)
+    if min_m2 is not None:
+        query += " AND exclu_use_ar >= ?"
+        params.append(min_m2)
+    if max_m2 is not None:
+        query += " AND exclu_use_ar <= ?"
+        params.append(max_m2)
+    with _lock:
+        cursor = conn.execute(query, params)
+        cols = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+    
+    # 행 튜플을 컬럼 단위로 모아 Arrow 배열로 바로 변환 (pyarrow 기반 dtype, 문자열 컬럼도 Python 객체 없이 보관)
+    values = list(zip(*rows)) if rows else [()] * len(cols)
+    table = pa.table({c: pa.array(v, type=TRADE_ARROW_TYPES.get(c)) for c, v in zip(cols, values)})
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
 
 def delete_trades(lawd_cd: str):
     """특정 지역의 데이터를 모두 삭제합니다."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM trade_raw WHERE lawd_cd = ?", (lawd_cd,))
-    conn.commit()
-    conn.close()
+    with _lock:
+        conn.execute("DELETE FROM trade_raw WHERE lawd_cd = ?", (lawd_cd,))
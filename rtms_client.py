@@ -1,13 +1,50 @@
 import streamlit as st
 import os
+import io
+import re
+import html
 import requests
-import xmltodict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.etree.ElementTree import iterparse
 import pandas as pd
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
 import time
 from urllib.parse import unquote
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 병렬 수집 시 워커별 요청 후 대기 시간 (API 호출 간격 유지)
+REQUEST_INTERVAL_SEC = 0.1
+
+# 페이지당 요청 건수, 월 단위 최대 동시 요청 수, 월별 추가 페이지 동시 요청 수
+# (월 단위 요청은 추가 페이지를 받는 동안 대기하므로 동시 연결은 최대 FETCH_WORKERS x PAGE_WORKERS, 세션 풀 크기도 이 값으로 맞춤)
+PAGE_SIZE = 1000
+FETCH_WORKERS = 4
+PAGE_WORKERS = 2
+
+# 필드별 원본 키 후보 (필드명이 한글/camelCase/대문자인 경우 모두 대응, Gateway API 특성상 다를 수 있음)
+FIELD_KEYS = {
+    "deal_year": ("년", "dealYear", "DEAL_YEAR"),
+    "deal_month": ("월", "dealMonth", "DEAL_MONTH"),
+    "deal_day": ("일", "dealDay", "DEAL_DAY"),
+    "deal_amount": ("거래금액", "dealAmount", "DEAL_AMOUNT"),
+    "apt_seq": ("일련번호", "aptSeq", "APT_SEQ"),
+    "apt_nm": ("아파트", "aptNm", "APT_NM"),
+    "umd_nm": ("법정동", "umdNm", "UMD_NM"),
+    "jibun": ("지번", "jibun"),
+    "exclu_use_ar": ("전용면적", "excluUseAr"),
+    "floor": ("층", "floor"),
+    "build_year": ("건축년도", "buildYear")
+}
+
+# 응답 XML 구조가 고정되어 있으므로 item 블록과 사용 필드만 정규식으로 바로 추출
+# (필드는 값이 있는 <tag>값</tag>와 빈 <tag/> 모두 인식, 빈 태그는 None)
+ITEM_RE = re.compile(r"<item>(.*?)</item>", re.S)
+FIELD_RE = re.compile(
+    r"<(" + "|".join(re.escape(k) for names in FIELD_KEYS.values() for k in names) + r")"
+    r"(?:\s*/>|>\s*([^<]*?)\s*</\1>)"
+)
+RESULT_CODE_RE = re.compile(r"<(resultCode|result_code)>\s*([^<]*?)\s*</\1>")
+TOTAL_COUNT_RE = re.compile(rb"<totalCount>\s*(\d+)\s*</totalCount>")
 
 class RateLimitError(Exception):
     pass
@@ -25,146 +62,226 @@ class RTMSClient:
         try:
             if "RTMS_SERVICE_KEY" in st.secrets:
                 self.service_key = st.secrets["RTMS_SERVICE_KEY"]
-        except:
+        except Exception:
+            # secrets 파일이 없거나 읽을 수 없으면 환경변수로 대체
             pass
             
         if not self.service_key:
             self.service_key = os.environ.get("RTMS_SERVICE_KEY")
             
+        # 공백 제거는 한 번만 (hex 키이므로 별도 디코딩 불필요)
+        self.service_key = self.service_key.strip() if self.service_key else None
+            
         if not self.service_key:
             raise ValueError("인증키를 찾을 수 없습니다. Streamlit Secrets 또는 환경변수에 'RTMS_SERVICE_KEY'를 설정해주세요.")
 
         self.base_url = "https://apis.data.go.kr/1613000/RTMSDataSvcAptTradeDev"
+        
+        # 월별 호출마다 TCP/TLS 연결을 새로 맺지 않도록 세션을 재사용 (keep-alive, gzip 응답)
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip"})
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=FETCH_WORKERS * PAGE_WORKERS,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount("https://", adapter)
+        
+        # 디버깅 파일(요청 URL, 응답 XML) 저장 여부: RTMS_DEBUG=1 일 때만 기록
+        self._debug = os.environ.get("RTMS_DEBUG") == "1"
 
     def fetch_monthly_data(self, lawd_cd: str, deal_ymd: str):
         """
         fetches apartment trade data for a specific month.
         deal_ymd: YYYYMM
+        pages after the first are requested concurrently.
         """
-        # 공백 제거 및 원본 키 사용 (hex 키이므로 별도 디코딩 불필요)
-        service_key = self.service_key.strip() if self.service_key else None
+        try:
+            result_code, res_items, total_count = self._fetch_page(lawd_cd, deal_ymd, 1)
+            
+            if result_code == "000":
+                # items가 없을 수도 있음 (데이터가 0건인 경우)
+                # 첫 페이지의 totalCount로 남은 페이지를 계산하여 세션을 공유해 동시에 요청
+                pages = range(2, -(-total_count // PAGE_SIZE) + 1)
+                if pages:
+                    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+                        results = executor.map(lambda page_no: self._fetch_page(lawd_cd, deal_ymd, page_no), pages)
+                        for page_no, (page_code, page_items, _) in zip(pages, results):
+                            if page_code == "22":
+                                raise RateLimitError("API Rate Limit Exceeded")
+                            if page_code != "000":
+                                # 일부 페이지만 저장되지 않도록 월 전체를 실패로 처리
+                                raise ApiError(f"page {page_no} resultCode {page_code}")
+                            res_items.extend(page_items)
+                return res_items, result_code
+            
+            elif result_code == "22":
+                raise RateLimitError("API Rate Limit Exceeded")
+            
+            else:
+                return [], result_code
         
+        except RateLimitError:
+            # 호출 한도 초과는 ApiError로 감싸지 않고 그대로 전달 (호출 측에서 구분하여 중단)
+            raise
+        except Exception as e:
+            # 실패 원인은 한 줄로만 기록 (원본 응답은 RTMS_DEBUG=1 로 debug_api.xml에서 확인)
+            with open("debug_error.log", "w", encoding="utf-8") as f:
+                f.write(f"{lawd_cd} {deal_ymd} {type(e).__name__}: {' '.join(str(e).split())}\n")
+            raise ApiError(f"API Error: {e}")
+
+    def _fetch_page(self, lawd_cd: str, deal_ymd: str, page_no: int):
+        """
+        fetches one page of a month.
+        returns (resultCode, list of item dicts, totalCount)
+        """
         params = {
-            "serviceKey": service_key,
+            "serviceKey": self.service_key,
             "LAWD_CD": lawd_cd,
             "DEAL_YMD": deal_ymd,
-            "numOfRows": 9999,
-            "pageNo": 1,
+            "numOfRows": PAGE_SIZE,
+            "pageNo": page_no,
             "type": "xml" # 명시적으로 XML 요청
         }
         
         # 상세 자료 API 오퍼레이션 명칭
         target_url = f"{self.base_url}/getRTMSDataSvcAptTradeDev"
         
-        try:
-            # 타임아웃을 넉넉히 잡고 호출
-            response = requests.get(
-                target_url, 
-                params=params, 
-                timeout=(5, 30)
-            )
-            
+        # 타임아웃을 넉넉히 잡고 호출
+        response = self.session.get(
+            target_url, 
+            params=params, 
+            timeout=(5, 30)
+        )
+        body = response.content
+        
+        if self._debug:
             # 디버깅: URL은 따로 저장
             with open("debug_url.txt", "w", encoding="utf-8") as f:
                 f.write(response.url)
                 
-            # 디버깅: XML 전문 저장 (깨끗하게 XML만 저장)
-            with open("debug_api.xml", "w", encoding="utf-8") as f:
-                f.write(response.text)
-                
-            response.raise_for_status()
-            data = xmltodict.parse(response.text)
-            
-            # 파싱된 딕셔너리 구조 확인을 위해 저장
-            with open("debug_api_data.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
-            header = data.get("response", {}).get("header", {})
-            result_code = header.get("resultCode") or header.get("result_code")
+            # 디버깅: XML 전문 저장 (문자열로 디코딩하지 않고 받은 바이트 그대로 저장)
+            with open("debug_api.xml", "wb") as f:
+                f.write(body)
             
-            if result_code == "000":
-                body = data.get("response", {}).get("body", {})
-                if not body:
-                    return [], result_code
-                
-                # items가 없을 수도 있음 (데이터가 0건인 경우)
-                items_container = body.get("items")
-                if not items_container:
-                    return [], result_code
-                
-                items = items_container.get("item")
-                if not items:
-                    return [], result_code
-                    
-                res_items = [items] if isinstance(items, dict) else items
-                return res_items, result_code
-            
-            elif result_code == "22":
-                raise RateLimitError("API Rate Limit Exceeded")
-            
-            else:
-                msg = header.get("resultMsg", "Unknown Error")
-                return [], result_code
-                
-        except Exception as e:
-            # 파싱 실패 시 원본 텍스트 기록을 위해 예외 처리 강화
-            with open("debug_error.log", "w", encoding="utf-8") as f:
-                f.write(str(e))
-            raise ApiError(f"API Error: {e}")
+        response.raise_for_status()
+        result_code, items = self._parse_items(body)
+        
+        # totalCount는 item 목록 뒤에 오므로 본문 끝까지 검색
+        m = TOTAL_COUNT_RE.search(body)
+        return result_code, items, int(m.group(1)) if m else 0
+
+    def fetch_range(self, lawd_cd: str, start_ymd: str, end_ymd: str, max_workers: int = FETCH_WORKERS):
+        """
+        fetches every month between start_ymd and end_ymd (YYYYMM) concurrently.
+        yields (deal_ymd, items, result_code) in completion order.
+        max_workers is capped at FETCH_WORKERS so that concurrent page requests
+        (max_workers * PAGE_WORKERS) stay within the session pool.
+        """
+        max_workers = min(max_workers, FETCH_WORKERS)
+        months = self.get_date_range(start_ymd, end_ymd)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._fetch_paced, lawd_cd, ymd): ymd for ymd in months}
+            try:
+                for future in as_completed(futures):
+                    items, result_code = future.result()
+                    yield futures[future], items, result_code
+            finally:
+                # 오류(예: 호출 한도 초과) 또는 중단 시 아직 시작하지 않은 월은 취소
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_paced(self, lawd_cd: str, deal_ymd: str):
+        # 작업 스레드에서 실행: 요청 후 잠시 대기하여 워커별 호출 간격 유지
+        result = self.fetch_monthly_data(lawd_cd, deal_ymd)
+        time.sleep(REQUEST_INTERVAL_SEC)
+        return result
+
+    def _parse_items(self, body):
+        """
+        extracts items from the response body with the precompiled field regexes.
+        returns (resultCode, list of item dicts)
+        """
+        # 본문은 한 번만 디코딩 (빈 값은 None, 엔티티(&amp; 등)는 있을 때만 해제)
+        text = body.decode("utf-8")
+        items = [
+            {tag: (html.unescape(value) if "&" in value else value) if value else None for tag, value in FIELD_RE.findall(block)}
+            for block in ITEM_RE.findall(text)
+        ]
+        if not items:
+            # item이 없는 응답(0건, 오류 등)은 XML 파서로 헤더의 결과 코드를 확인
+            return self._iterparse_items(io.BytesIO(body))
+        
+        m = RESULT_CODE_RE.search(text)
+        return (m.group(2) if m else None), items
+
+    def _iterparse_items(self, source):
+        """
+        parses the response XML as a stream.
+        returns (resultCode, list of item dicts)
+        """
+        result_code = None
+        items = []
+        parent = None
+        for event, elem in iterparse(source, events=("start", "end")):
+            if event == "start":
+                if elem.tag == "items":
+                    parent = elem
+            elif elem.tag == "item":
+                items.append({child.tag: (child.text or "").strip() or None for child in elem})
+                # 처리한 item은 부모에서 떼어내 메모리 사용을 item 단위로 유지
+                elem.clear()
+                if parent is not None:
+                    parent.remove(elem)
+            elif elem.tag in ("resultCode", "result_code"):
+                result_code = (elem.text or "").strip()
+        return result_code, items
 
     def get_date_range(self, start_month_str, end_month_str):
-        start = datetime.strptime(start_month_str, "%Y%m")
-        end = datetime.strptime(end_month_str, "%Y%m")
-        curr = start
-        res = []
-        while curr <= end:
-            res.append(curr.strftime("%Y%m"))
-            curr += relativedelta(months=1)
-        return res
+        # 년월을 (년*12 + 월-1) 정수로 바꿔 월 단위로 순회 (datetime 객체 생성 없음)
+        start = int(start_month_str[:4]) * 12 + int(start_month_str[4:6]) - 1
+        end = int(end_month_str[:4]) * 12 + int(end_month_str[4:6]) - 1
+        return [f"{m // 12:04d}{m % 12 + 1:02d}" for m in range(start, end + 1)]
 
     def process_items(self, items, lawd_cd):
         if not items:
             return pd.DataFrame()
         
-        processed = []
-        for item in items:
-            # 필드명이 대문자인 경우와 한글인 경우 모두 대응 (Gateway API 특성상 다를 수 있음)
-            year = item.get("년") or item.get("dealYear") or item.get("DEAL_YEAR")
-            month = item.get("월") or item.get("dealMonth") or item.get("DEAL_MONTH")
-            day = item.get("일") or item.get("dealDay") or item.get("DEAL_DAY")
-            
-            # 필수 날짜 정보가 하나라도 없으면 해당 데이터는 건너뜁니다
-            if year is None or month is None or day is None:
-                continue
-                
-            try:
-                # 금액 정제: "1,200" 또는 숫자 처리
-                raw_amount = item.get("거래금액") or item.get("dealAmount") or item.get("DEAL_AMOUNT") or "0"
-                amount_str = str(raw_amount).replace(",", "").strip()
-                deal_amount = int(amount_str)
-                
-                # 식별자 추출 보강
-                apt_seq = item.get("일련번호") or item.get("aptSeq") or item.get("APT_SEQ") or "unknown"
-                apt_nm = item.get("아파트") or item.get("aptNm") or item.get("APT_NM") or "unknown"
-                umd_nm = item.get("법정동") or item.get("umdNm") or item.get("UMD_NM") or ""
-
-                processed.append({
-                    "lawd_cd": lawd_cd,
-                    "deal_ymd": int(f"{int(year)}{int(month):02d}"),
-                    "deal_year": int(year),
-                    "deal_month": int(month),
-                    "deal_day": int(day),
-                    "apt_seq": str(apt_seq).strip(),
-                    "apt_nm": str(apt_nm).strip(),
-                    "umd_nm": str(umd_nm).strip(),
-                    "jibun": item.get("지번") or item.get("jibun"),
-                    "exclu_use_ar": float(item.get("전용면적") or item.get("excluUseAr") or 0),
-                    "deal_amount": deal_amount,
-                    "floor": int(item.get("층") or item.get("floor") or 0),
-                    "build_year": int(item.get("건축년도") or item.get("buildYear") or 0)
-                })
-            except:
-                # 데이터 형식이 잘못된 경우 건너뜠습니다
-                continue
-                
-        return pd.DataFrame(processed)
+        # 필드명 형태는 첫 item에서 한 번만 판별하고, 사용하는 필드만 DataFrame으로 구성
+        sample = items[0]
+        keys = {field: next((k for k in names if k in sample), None) for field, names in FIELD_KEYS.items()}
+        raw = pd.DataFrame.from_records(items, columns=[k for k in keys.values() if k])
+        
+        def pick(field):
+            key = keys[field]
+            return raw[key] if key else pd.Series(None, index=raw.index, dtype=object)
+        
+        # 금액 정제: "1,200" 또는 숫자 처리
+        amount = pick("deal_amount").fillna("0").astype(str)
+        
+        # 숫자 필드는 컬럼 단위로 변환 (형식이 잘못된 값은 NaN)
+        df = pd.DataFrame({
+            "lawd_cd": lawd_cd,
+            "deal_year": pd.to_numeric(pick("deal_year"), errors="coerce"),
+            "deal_month": pd.to_numeric(pick("deal_month"), errors="coerce"),
+            "deal_day": pd.to_numeric(pick("deal_day"), errors="coerce"),
+            # 식별자 추출 보강
+            "apt_seq": pick("apt_seq").fillna("unknown").astype(str).str.strip(),
+            "apt_nm": pick("apt_nm").fillna("unknown").astype(str).str.strip(),
+            "umd_nm": pick("umd_nm").fillna("").astype(str).str.strip(),
+            "jibun": pick("jibun"),
+            "exclu_use_ar": pd.to_numeric(pick("exclu_use_ar").fillna(0), errors="coerce"),
+            "deal_amount": pd.to_numeric(amount.str.replace(",", "", regex=False).str.strip(), errors="coerce"),
+            "floor": pd.to_numeric(pick("floor").fillna(0), errors="coerce"),
+            "build_year": pd.to_numeric(pick("build_year").fillna(0), errors="coerce")
+        })
+        
+        # 필수 날짜 정보가 없거나 데이터 형식이 잘못된 행은 건너뜁니다
+        numeric_cols = ["deal_year", "deal_month", "deal_day", "exclu_use_ar", "deal_amount", "floor", "build_year"]
+        # 연/월/일/층/건축년도는 작은 정수형으로 변환 (exclu_use_ar는 UNIQUE 키와 밴드 경계 비교에 쓰이므로 float64 유지)
+        df = df.dropna(subset=numeric_cols).astype({
+            "deal_year": "int16", "deal_month": "int8", "deal_day": "int8",
+            "deal_amount": "int64", "floor": "int16", "build_year": "int16"
+        })
+        df.insert(1, "deal_ymd", df["deal_year"].astype("int32") * 100 + df["deal_month"])
+        
+        return df.reset_index(drop=True)